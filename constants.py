@@ -2,6 +2,10 @@
 SCS_CN_METHOD_NUMBER = 254  # constant provided by U.S. Soil Conservation Service
 INITIAL_ABSTRACTION_RATIO = 0.2  # it's assumed that 20% of the maximum storage infiltrates immediately
 
+# Convolution constants:
+FFT_CONVOLUTION_THRESHOLD = 4096  # above this product of series lengths, convolve through the FFT
+
 # plot constants
 TIME_UNIT = 's'
 DEFAULT_SERIES_LABEL = 'unnamed'
+MAX_XTICKS = 30  # longer series only get every n-th pulse ticked
@@ -1,9 +1,13 @@
+import math
 import warnings
-from typing import Protocol
+from dataclasses import dataclass, field
+from typing import Protocol, Sequence, Union
 import numpy as np
+from numpy.typing import NDArray
 from matplotlib.axes import Axes
 
-from src.constants import INITIAL_ABSTRACTION_RATIO, SCS_CN_METHOD_NUMBER, TIME_UNIT, DEFAULT_SERIES_LABEL
+from src.constants import INITIAL_ABSTRACTION_RATIO, SCS_CN_METHOD_NUMBER, TIME_UNIT, DEFAULT_SERIES_LABEL, \
+    FFT_CONVOLUTION_THRESHOLD, MAX_XTICKS
 from src.exceptions import NotAUnitHydrographError, DeltaTimeMismatchError, GraphTypeMismatchError, \
     NotSupportedStyleError
 from src.types import Hyetograph, Hydrograph, TimeSeries
@@ -14,51 +18,188 @@ class Plottable(Protocol):
     time_series: TimeSeries
 
 
-def get_convolution(hyetograph: Hyetograph, unit_hydrograph: Hydrograph) -> Hydrograph:
+def _fast_trim_zeros(a: NDArray, block: int = 1024) -> NDArray:
     """
-    Returns Hydrograph as the convolution of excess rain hyetograph with unit hydrograph
-    :param hyetograph: excess rain hyetograph
-    :param unit_hydrograph: unit hydrograph (hydrograph associated to a unit single-pulse hyetograph)
-    :return: hydrograph resulting from the convolution, which 'associated_hyetograph' is 'hyetograph'
-    :rtype: Hydrograph
+    Trims leading and trailing zeros from a 1-D array (same result as np.trim_zeros),
+    scanning 'block'-sized chunks with np.any and only looking element-wise inside the boundary blocks
+    :param a: 1-D array to trim
+    :param block: number of elements scanned at once
+    :return: view of 'a' without leading and trailing zeros
+    :rtype: NDArray
+    """
+    size = len(a)
+    start = 0
+    while start < size and not np.any(a[start:start + block]):
+        start += block
+    if start >= size:
+        return a[:0]
+    start += np.flatnonzero(a[start:start + block])[0]
+
+    stop = size
+    while not np.any(a[max(stop - block, start):stop]):
+        stop -= block
+    boundary = max(stop - block, start)
+    stop = boundary + np.flatnonzero(a[boundary:stop])[-1] + 1
+    return a[start:stop]
+
+
+def _result_dtype(*series: NDArray) -> np.dtype:
+    """
+    Returns the type a series derived from 'series' is stored as:
+    the callers' precision, promoted to floating point for integer inputs
+    """
+    return np.result_type(*series, np.float32)
+
+
+def _fft_length(n: int) -> int:
+    """
+    Returns the smallest power of two not lower than n, so that convolutions of similar lengths
+    share the same FFT size (and the same cached unit hydrograph spectrum)
+    """
+    return 1 << (n - 1).bit_length()
+
+
+@dataclass(slots=True)
+class UnitHydrographFFT:
+    """
+    Unit hydrograph together with its real FFTs, kept for repeated convolutions against it \n
+    'unit_hydrograph': unit hydrograph being transformed
+    """
+    unit_hydrograph: Hydrograph
+    _spectra: dict[int, NDArray] = field(default_factory=dict, init=False, repr=False, compare=False)
+
+    def spectrum(self, nfft: int) -> NDArray:
+        """
+        Returns the real FFT of the unit hydrograph zero-padded to 'nfft' samples.
+        Spectra are cached per FFT length and are not invalidated if the unit hydrograph's data changes
+        :param nfft: FFT length
+        :return: 1-D complex array of length nfft // 2 + 1
+        :rtype: NDArray
+        """
+        if nfft not in self._spectra:
+            self._spectra[nfft] = np.fft.rfft(self.unit_hydrograph.time_series.data, nfft)
+        return self._spectra[nfft]
+
+
+def _as_unit_hydrograph_fft(unit_hydrograph: Union[Hydrograph, UnitHydrographFFT]) -> UnitHydrographFFT:
+    """
+    Returns 'unit_hydrograph' wrapped in a UnitHydrographFFT, unless it already is one
+    (wrapping is cheap: spectra are only computed when needed)
+    """
+    if isinstance(unit_hydrograph, UnitHydrographFFT):
+        return unit_hydrograph
+    return UnitHydrographFFT(unit_hydrograph)
+
+
+def _fft_convolve(rain: NDArray, unit_hydrograph_fft: UnitHydrographFFT) -> NDArray:
+    """
+    Returns the full discrete convolution of 'rain' with the unit hydrograph along the last axis,
+    computed through the real FFT with the cached unit hydrograph spectrum,
+    zero-padding to the next power of two
+    :param rain: 1-D array, or 2-D array with one hyetograph per row
+    :param unit_hydrograph_fft: unit hydrograph to convolve with
+    :return: array whose last axis has length rain.shape[-1] + len(unit hydrograph) - 1
+    :rtype: NDArray
+    """
+    n = rain.shape[-1] + len(unit_hydrograph_fft.unit_hydrograph.time_series.data) - 1
+    nfft = _fft_length(n)
+    return np.fft.irfft(np.fft.rfft(rain, nfft) * unit_hydrograph_fft.spectrum(nfft), nfft)[..., :n]
+
+
+def _check_convolution_operands(hyetograph: Hyetograph, unit_hydrograph: Hydrograph) -> None:
+    """
+    Checks that 'hyetograph' can be convolved with 'unit_hydrograph'
     :raises NotAUnitHydrographError if unit_hydrograph is not a unit hydrograph
     :raises DeltaTimeMismatchError if hyetograph and unit_hydrograph have different 'delta_time'
     """
-
     if not np.array_equal(unit_hydrograph.associated_hyetograph.time_series.data, np.array([1])):
         raise NotAUnitHydrographError("Only a unit hydrograph is supported")
 
     if hyetograph.time_series.delta_time != unit_hydrograph.time_series.delta_time:
         raise DeltaTimeMismatchError("Unit Hydrograph and Hyetograph pulses must have the same duration")
 
+
+def get_convolution(hyetograph: Hyetograph, unit_hydrograph: Union[Hydrograph, UnitHydrographFFT]) -> Hydrograph:
+    """
+    Returns Hydrograph as the convolution of excess rain hyetograph with unit hydrograph
+    :param hyetograph: excess rain hyetograph
+    :param unit_hydrograph: unit hydrograph (hydrograph associated to a unit single-pulse hyetograph),
+    or its UnitHydrographFFT to reuse its spectrum across calls
+    :return: hydrograph resulting from the convolution, which 'associated_hyetograph' is 'hyetograph'
+    :rtype: Hydrograph
+    :raises NotAUnitHydrographError if unit_hydrograph is not a unit hydrograph
+    :raises DeltaTimeMismatchError if hyetograph and unit_hydrograph have different 'delta_time'
+    """
+    unit_hydrograph_fft = _as_unit_hydrograph_fft(unit_hydrograph)
+    unit_hydrograph = unit_hydrograph_fft.unit_hydrograph
+    _check_convolution_operands(hyetograph, unit_hydrograph)
+
     hy_series = hyetograph.time_series.data
     uh_series = unit_hydrograph.time_series.data
     delta_time = hyetograph.time_series.delta_time
 
-    hyetograph_length = len(hy_series)
-    uh_length = len(uh_series)
-    n = uh_length + hyetograph_length - 1
-    rain_matrix = np.zeros((n, uh_length))
-
-    for i, pulse in enumerate(hy_series):
-        """
-        Creates a rainfall matrix ('rain_matrix'): 
-        P = [[p1, 0, 0, ...], [p2, p1, 0, ...], [p3, p2, p1, ...], ..., [0, pn, pn-1, ...], ...] 
-        where p1, p2, ..., pn are the pulses of the hyetograph
-        """
-        rain_matrix += np.vstack(
-            [np.zeros((i, uh_length)),
-             np.eye(uh_length) * pulse,
-             np.zeros((hyetograph_length - i - 1, uh_length))]
-        )
-
-    series_data = np.dot(rain_matrix, uh_series)
-    result_series = TimeSeries(delta_time, series_data, label="m3/s")
+    # P * U where P is the banded rainfall matrix
+    # [[p1, 0, 0, ...], [p2, p1, 0, ...], [p3, p2, p1, ...], ..., [0, pn, pn-1, ...], ...]
+    # is exactly the full 1-D discrete convolution of the pulses with the unit hydrograph.
+    # A hyetograph without excess rainfall (empty) results in a zero hydrograph
+    if len(hy_series) == 0:
+        series_data = np.zeros(len(uh_series) - 1)
+    elif len(hy_series) * len(uh_series) < FFT_CONVOLUTION_THRESHOLD:
+        series_data = np.convolve(hy_series, uh_series, mode='full')
+    else:
+        series_data = _fft_convolve(hy_series, unit_hydrograph_fft)
+    result_series = TimeSeries(delta_time, series_data, label="m3/s", dtype=_result_dtype(hy_series, uh_series))
     return Hydrograph(f"Convolution of {hyetograph.name} and {unit_hydrograph.name}",
                       result_series,
                       hyetograph)
 
 
+def get_convolutions(hyetographs: Sequence[Hyetograph],
+                     unit_hydrograph: Union[Hydrograph, UnitHydrographFFT]) -> list[Hydrograph]:
+    """
+    Returns the Hydrographs resulting from convolving each excess rain hyetograph with the same unit hydrograph
+    (e.g. an ensemble of rainfall scenarios or a parameter sweep), computing all the convolutions at once
+    :param hyetographs: excess rain hyetographs, possibly of different lengths
+    :param unit_hydrograph: unit hydrograph (hydrograph associated to a unit single-pulse hyetograph),
+    or its UnitHydrographFFT to reuse its spectrum across calls
+    :return: hydrographs resulting from the convolutions, in the same order as 'hyetographs'
+    :rtype: list[Hydrograph]
+    :raises NotAUnitHydrographError if unit_hydrograph is not a unit hydrograph
+    :raises DeltaTimeMismatchError if any hyetograph and unit_hydrograph have different 'delta_time'
+    """
+    unit_hydrograph_fft = _as_unit_hydrograph_fft(unit_hydrograph)
+    unit_hydrograph = unit_hydrograph_fft.unit_hydrograph
+
+    for hyetograph in hyetographs:
+        _check_convolution_operands(hyetograph, unit_hydrograph)
+    if not hyetographs:
+        return []
+
+    uh_series = unit_hydrograph.time_series.data
+    delta_time = unit_hydrograph.time_series.delta_time
+    lengths = [len(hyetograph.time_series.data) for hyetograph in hyetographs]
+    dtype = _result_dtype(uh_series, *(hyetograph.time_series.data for hyetograph in hyetographs))
+
+    # one zero-padded row per scenario, so that all of them are convolved at once
+    rain = np.zeros((len(hyetographs), max(lengths)), dtype=dtype)
+    for row, hyetograph, length in zip(rain, hyetographs, lengths):
+        row[:length] = hyetograph.time_series.data
+
+    uh_length = len(uh_series)
+    n = rain.shape[1] + uh_length - 1
+    if rain.shape[1] * uh_length < FFT_CONVOLUTION_THRESHOLD:
+        series_data = np.zeros((len(hyetographs), n), dtype=dtype)
+        for k, ordinate in enumerate(uh_series):
+            series_data[:, k:k + rain.shape[1]] += rain * ordinate
+    else:
+        series_data = _fft_convolve(rain, unit_hydrograph_fft)
+
+    return [Hydrograph(f"Convolution of {hyetograph.name} and {unit_hydrograph.name}",
+                       TimeSeries(delta_time, row[:length + uh_length - 1], label="m3/s", dtype=dtype),
+                       hyetograph)
+            for hyetograph, row, length in zip(hyetographs, series_data, lengths)]
+
+
 def get_excess_rainfall_hyetograph_cn(hyetograph: Hyetograph, curve_number: float) -> Hyetograph:
     """
     Returns excess rainfall hyetograph for a given curve number
@@ -77,20 +218,32 @@ def get_excess_rainfall_hyetograph_cn(hyetograph: Hyetograph, curve_number: floa
     series = hyetograph.time_series.data
     label = hyetograph.time_series.label
     delta_time = hyetograph.time_series.delta_time
-    total_rainfall = hyetograph.total_rainfall
+    name = f"Excess rainfall hyetograph from {hyetograph.name} for curve number {curve_number}"
+
+    if len(series) == 0:
+        return Hyetograph(name, TimeSeries(delta_time, series, label=label, dtype=_result_dtype(series)))
 
     maximum_storage = (100 / curve_number - 1) * SCS_CN_METHOD_NUMBER
     max_i_a = INITIAL_ABSTRACTION_RATIO * maximum_storage
-    cum_rainfall = np.cumsum(series)
-    initial_abstraction = np.array([max_i_a if p > max_i_a else p for p in cum_rainfall])
-
-    continuous_abstraction = maximum_storage * (cum_rainfall - initial_abstraction) / \
-                             (total_rainfall - initial_abstraction + maximum_storage)
-    cum_excess_rainfall = cum_rainfall - continuous_abstraction - initial_abstraction
-    excess_rainfall = np.trim_zeros(np.diff(cum_excess_rainfall, prepend=0))
-    result_series = TimeSeries(delta_time, excess_rainfall, label=label)
-    return Hyetograph(f"Excess rainfall hyetograph from {hyetograph.name} for curve number {curve_number}",
-                      result_series)
+
+    # Excess rainfall = P - Ia - Fa, with Ia = min(P, max_i_a) and Fa = S * (P - Ia) / (P_total - Ia + S).
+    # While P <= max_i_a every drop is abstracted; afterwards Ia is constant and the expression
+    # reduces to (P - max_i_a) scaled by a single runoff ratio.
+    # The cumulative rainfall buffer (double precision at least, as pulses are recovered by differencing it),
+    # whose last value is the total rainfall, is transformed in place into the cumulative excess rainfall
+    cum_excess_rainfall = np.cumsum(series, dtype=np.result_type(series, float))
+    total_rainfall = cum_excess_rainfall[-1]
+    runoff_ratio = (total_rainfall - max_i_a) / (total_rainfall - max_i_a + maximum_storage)
+    np.subtract(cum_excess_rainfall, max_i_a, out=cum_excess_rainfall)
+    np.maximum(cum_excess_rainfall, 0, out=cum_excess_rainfall)
+    np.multiply(cum_excess_rainfall, runoff_ratio, out=cum_excess_rainfall)
+
+    excess_rainfall = np.empty_like(cum_excess_rainfall)
+    excess_rainfall[:1] = cum_excess_rainfall[:1]
+    np.subtract(cum_excess_rainfall[1:], cum_excess_rainfall[:-1], out=excess_rainfall[1:])
+    excess_rainfall = _fast_trim_zeros(excess_rainfall)
+    result_series = TimeSeries(delta_time, excess_rainfall, label=label, dtype=_result_dtype(series))
+    return Hyetograph(name, result_series)
 
 
 def get_excess_rainfall_hyetograph_phi(hyetograph: Hyetograph, phi: float) -> Hyetograph:
@@ -110,11 +263,11 @@ def get_excess_rainfall_hyetograph_phi(hyetograph: Hyetograph, phi: float) -> Hy
 
     if phi < 0:
         raise ValueError("Phi must be positive")
-    if phi > max(series):
+    if phi > series.max():
         warnings.warn("Hyetograph has no excess rainfall", UserWarning)
-    excess_rainfall = series - phi
-    excess_rainfall[excess_rainfall < 0] = 0
-    result_series = TimeSeries(delta_time, np.trim_zeros(excess_rainfall), label=label)
+    excess_rainfall = np.maximum(series - phi, 0.0)
+    result_series = TimeSeries(delta_time, _fast_trim_zeros(excess_rainfall), label=label,
+                               dtype=_result_dtype(series))
     return Hyetograph(f"Excess rainfall hyetograph from {hyetograph.name} for phi = {phi}",
                       result_series)
 
@@ -130,21 +283,22 @@ def plot(graph: Plottable, ax: Axes, style: str = 'bar') -> Axes:
     :rtype: Axes
     """
     series = graph.time_series.data
-    total_duration = graph.time_series.total_duration
+    time_axis = graph.time_series.time_axis
     delta_t = graph.time_series.delta_time
     label = graph.time_series.label or DEFAULT_SERIES_LABEL
     
     if style == 'bar':
-        ax.bar(np.arange(0, total_duration, delta_t), series, width=delta_t, align="edge", label=graph.name)
+        ax.bar(time_axis, series, width=delta_t, align="edge", label=graph.name)
     elif style == 'line':
-        ax.plot(np.arange(0, total_duration, delta_t), series, label=graph.name)
+        ax.plot(time_axis, series, label=graph.name)
     else:
         raise NotSupportedStyleError(f"Style {style} is not supported. Choose either of 'bar' or 'line'")
 
+    tick_stride = max(1, math.ceil(len(time_axis) / MAX_XTICKS))
     start, stop = ax.get_xlim()
     ax.set(xlabel=F"T [{TIME_UNIT}]",
            ylabel=label,
-           xticks=np.arange(0, total_duration, step=delta_t))
+           xticks=time_axis[::tick_stride])
     ax.set_xlim(xmin=0)
     ax.set_ylim(ymin=0)
     return ax
@@ -160,7 +314,7 @@ def plot_multiple(ax: Axes, *graphs: Plottable) -> Axes:
     :rtype: Axes
     :raises GraphTypeMismatchError if graphs are not of the same type
     """
-    if len(set([type(g) for g in graphs])) > 1:
+    if graphs and any(type(g) is not type(graphs[0]) for g in graphs[1:]):
         raise GraphTypeMismatchError("All graphs must be of the same type")
     for graph in graphs:
         plot(graph, ax, style='line')
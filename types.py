@@ -1,35 +1,44 @@
-from dataclasses import dataclass, field
-from functools import cached_property
+from dataclasses import dataclass, field, InitVar
 from typing import Optional
 
 import numpy as np
-from numpy.typing import NDArray
+from numpy.typing import NDArray, DTypeLike
 
 from src.exceptions import DeltaTimeMismatchError, SeriesDimensionError
 
 
-@dataclass
+@dataclass(slots=True)
 class TimeSeries:
     """
     Representation of a time series graph \n
     'delta_time': time between two consecutive observations in 'data' \n
-    'data': 1-D numpy array containing the observations of the time series
+    'data': 1-D numpy array containing the observations of the time series \n
+    'dtype': type to store the observations as (by default, the type of 'data')
     """
 
     delta_time: int
     data: NDArray
     label: Optional[str] = field(default=None)
+    dtype: InitVar[Optional[DTypeLike]] = None
+    _time_axis: Optional[NDArray] = field(default=None, init=False, repr=False, compare=False)
 
-    def __post_init__(self):
-        if self.data.ndim != 1:
+    def __post_init__(self, dtype: Optional[DTypeLike]):
+        if np.ndim(self.data) != 1:
             raise SeriesDimensionError("Time series data must be 1-D")
+        self.data = np.ascontiguousarray(self.data, dtype=dtype)
 
-    @cached_property
+    @property
     def total_duration(self) -> int:
         return len(self.data) * self.delta_time
 
+    @property
+    def time_axis(self) -> NDArray:
+        if self._time_axis is None:
+            self._time_axis = np.arange(0, self.total_duration, self.delta_time)
+        return self._time_axis
 
-@dataclass
+
+@dataclass(slots=True)
 class Hyetograph:
     """
     Representation of a hyetograph (rainfall distribution over time) \n
@@ -38,13 +47,16 @@ class Hyetograph:
     """
     name: str
     time_series: TimeSeries
+    _total_rainfall: Optional[float] = field(default=None, init=False, repr=False, compare=False)
 
-    @cached_property
+    @property
     def total_rainfall(self) -> float:
-        return self.time_series.data.sum()
+        if self._total_rainfall is None:
+            self._total_rainfall = self.time_series.data.sum()
+        return self._total_rainfall
 
 
-@dataclass
+@dataclass(slots=True)
 class Hydrograph:
     """
     Representation of a hydrograph (discharge distribution over time) \n
@@ -55,6 +67,7 @@ class Hydrograph:
     name: str
     time_series: TimeSeries
     associated_hyetograph: Optional[Hyetograph] = field(default=None)
+    _total_volume: Optional[float] = field(default=None, init=False, repr=False, compare=False)
 
     def __post_init__(self):
         if self.associated_hyetograph is None:
@@ -68,9 +81,7 @@ class Hydrograph:
                                          f"hydrograph {self.name} do not match")
 
     @property
-    def total_volume(self):
-        return self.time_series.data.sum() * self.time_series.delta_time
-
-
-
-
+    def total_volume(self) -> float:
+        if self._total_volume is None:
+            self._total_volume = self.time_series.data.sum() * self.time_series.delta_time
+        return self._total_volume